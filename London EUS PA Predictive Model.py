@@ -4,10 +4,11 @@ import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
-import io
+import functools
+import hashlib
+from collections import namedtuple
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, mean_squared_error
+from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error, mean_squared_error
 
 # Configuration Constants - Operating hours by day
 OPERATIONAL_HOURS_WEEKDAY = [
@@ -22,8 +23,24 @@ OPERATIONAL_HOURS_SUNDAY = [
     '21:00', '22:00', '23:00'
 ]
 
+# Operational hours as minutes since midnight, for vectorised coverage checks
+OPERATIONAL_MIN_WEEKDAY = np.array([int(h[:2]) * 60 + int(h[3:]) for h in OPERATIONAL_HOURS_WEEKDAY], dtype=np.int16)
+OPERATIONAL_MIN_SUNDAY = np.array([int(h[:2]) * 60 + int(h[3:]) for h in OPERATIONAL_HOURS_SUNDAY], dtype=np.int16)
+
+# Minutes since midnight for quarter-hour times, in both HH:MM and raw roster HHMM form
+_MIN_OF = {f'{h:02d}:{m:02d}': h * 60 + m for h in range(24) for m in (0, 15, 30, 45)}
+_MIN_OF.update({f'{h:02d}{m:02d}': h * 60 + m for h in range(24) for m in (0, 15, 30, 45)})
+
+# Zero coverage templates, copied when a day has no rostered shifts
+_ZERO_COV_WEEKDAY = {hour: 0 for hour in OPERATIONAL_HOURS_WEEKDAY}
+_ZERO_COV_SUNDAY = {hour: 0 for hour in OPERATIONAL_HOURS_SUNDAY}
+
 DAYS_OF_WEEK = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 
+# pandas dayofweek codes (Monday=0) for each day name, and day names indexed by code
+DAYOFWEEK_CODES = {day: (i - 1) % 7 for i, day in enumerate(DAYS_OF_WEEK)}
+DAY_NAMES_BY_CODE = np.array(DAYS_OF_WEEK[1:] + DAYS_OF_WEEK[:1], dtype=object)
+
 # Updated hourly patterns (normalised for each day type)
 HOURLY_PATTERNS = {
     'Weekday': {
@@ -42,6 +59,19 @@ HOURLY_PATTERNS = {
     }
 }
 
+# Hourly patterns as arrays aligned with the operational hours of each day type
+HOURLY_PATTERNS_ARR = {
+    'Weekday': np.array([HOURLY_PATTERNS['Weekday'][h] for h in OPERATIONAL_HOURS_WEEKDAY]),
+    'Sunday': np.array([HOURLY_PATTERNS['Sunday'][h] for h in OPERATIONAL_HOURS_SUNDAY])
+}
+
+# Per-day lookups for the day-type dependent tables (Sunday vs every other day)
+_DAY_TYPE = {day: 'Sunday' if day == 'Sunday' else 'Weekday' for day in DAYS_OF_WEEK}
+_HOURS_BY_DAY = {day: OPERATIONAL_HOURS_SUNDAY if t == 'Sunday' else OPERATIONAL_HOURS_WEEKDAY for day, t in _DAY_TYPE.items()}
+_MIN_BY_DAY = {day: OPERATIONAL_MIN_SUNDAY if t == 'Sunday' else OPERATIONAL_MIN_WEEKDAY for day, t in _DAY_TYPE.items()}
+_ZERO_COV_BY_DAY = {day: _ZERO_COV_SUNDAY if t == 'Sunday' else _ZERO_COV_WEEKDAY for day, t in _DAY_TYPE.items()}
+_PATTERN_BY_DAY = {day: HOURLY_PATTERNS_ARR[t] for day, t in _DAY_TYPE.items()}
+
 # UK Bank Holidays dictionary
 UK_BANK_HOLIDAYS = {
     2023: {
@@ -80,6 +110,20 @@ UK_BANK_HOLIDAYS = {
     }
 }
 
+# Bank holiday periods flattened into one table, with dates parsed once at import
+_HOLIDAY_INDEX = pd.DataFrame(
+    [
+        (holiday_name, year) + (dates if isinstance(dates, tuple) else (dates, dates))
+        for year, holidays in UK_BANK_HOLIDAYS.items()
+        for holiday_name, dates in holidays.items()
+    ],
+    columns=['name', 'year', 'start', 'end']
+)
+_HOLIDAY_INDEX['start'] = pd.to_datetime(_HOLIDAY_INDEX['start'])
+_HOLIDAY_INDEX['end'] = pd.to_datetime(_HOLIDAY_INDEX['end'])
+_HOLIDAY_STARTS = _HOLIDAY_INDEX['start'].to_numpy()
+_HOLIDAY_ENDS = _HOLIDAY_INDEX['end'].to_numpy()
+
 DEFAULT_WEEKLY_PREDICTIONS = {
     'Sunday': 198, 'Monday': 302, 'Tuesday': 271, 'Wednesday': 271,
     'Thursday': 301, 'Friday': 289, 'Saturday': 280
@@ -87,19 +131,33 @@ DEFAULT_WEEKLY_PREDICTIONS = {
 
 DEFAULT_STAFF_EFFICIENCY = 4.26
 
+# Roster entries that mean no shift is worked
+NON_WORKING_ENTRIES = ['OFF', 'SPARE', 'RD', '', 'nan', 'Vacancy']
+
+# Default shift times for standalone shift codes
+DEFAULT_SHIFTS = {
+    '8': ('06:30', '14:30'),
+    '10': ('06:30', '16:30')
+}
+
 # Initialise Session State
 def initialise_session_state():
     """Initialise Streamlit session state with default values."""
     if 'roster_data' not in st.session_state:
         st.session_state.roster_data = None
+    if 'roster_min_arrays' not in st.session_state:
+        st.session_state.roster_min_arrays = None
     if 'trained_model' not in st.session_state:
         st.session_state.trained_model = None
     if 'weekly_predictions' not in st.session_state:
         st.session_state.weekly_predictions = DEFAULT_WEEKLY_PREDICTIONS.copy()
     if 'model_metrics' not in st.session_state:
         st.session_state.model_metrics = None
+    if 'debug' not in st.session_state:
+        st.session_state.debug = False
 
 # Data Processing Functions
+@st.cache_data(max_entries=4)
 def process_datasets(uploaded_files):
     """Process uploaded CSV datasets for model training."""
     if not uploaded_files:
@@ -110,39 +168,121 @@ def process_datasets(uploaded_files):
         try:
             # Extract year from filename (e.g., "2023 Database.csv")
             year = int(file.name.split()[0])
-            df = pd.read_csv(file)
-            df['year'] = year
-            dfs.append(df)
         except (ValueError, IndexError):
             st.error(f"Invalid filename format: {file.name}. Expected format: 'YYYY Database.csv'")
             continue
+        
+        try:
+            # Only the station and date columns are used downstream
+            df = pd.read_csv(
+                file,
+                usecols=['station_code', 'scheduled_departure_date'],
+                dtype={'station_code': 'category'},
+                parse_dates=['scheduled_departure_date'],
+                date_format='%d/%m/%Y'
+            )
+        except ValueError as e:
+            st.error(f"Could not read {file.name}: it must contain 'station_code' and 'scheduled_departure_date' columns ({str(e)})")
+            continue
+        
+        dfs.append((year, df))
     
     if not dfs:
         return None
     
     # Sort by year and combine
-    df_combined = pd.concat(sorted(dfs, key=lambda x: x['year'].iloc[0])).reset_index(drop=True)
+    dfs.sort(key=lambda pair: pair[0])
+    df_combined = pd.concat([df for _, df in dfs], ignore_index=True, copy=False)
+    
+    # Files with different station sets concatenate to object dtype
+    df_combined['station_code'] = df_combined['station_code'].astype('category')
+    
+    # Dates not in DD/MM/YYYY are left unparsed by read_csv; parse them once here
+    if not pd.api.types.is_datetime64_any_dtype(df_combined['scheduled_departure_date']):
+        df_combined['scheduled_departure_date'] = pd.to_datetime(
+            df_combined['scheduled_departure_date'], 
+            dayfirst=True, 
+            errors='coerce'
+        )
     return df_combined
 
+def _uploaded_files_key(uploaded_files):
+    """Identify a set of uploaded files by name and contents, independent of upload order."""
+    return tuple(sorted((f.name, hashlib.sha1(f.getvalue()).hexdigest()) for f in uploaded_files))
+
+def _combined_dataset(uploaded_files):
+    """Get the combined dataset, reusing the one already parsed this session for the same files."""
+    files_key = _uploaded_files_key(uploaded_files)
+    if st.session_state.get('df_combined_cached_hash') == files_key:
+        return st.session_state.df_combined_cached
+    
+    df_combined = process_datasets(uploaded_files)
+    if df_combined is not None:
+        st.session_state.df_combined_cached_hash = files_key
+        st.session_state.df_combined_cached = df_combined
+    return df_combined
+
+def _hash_dataframe(df):
+    """Hash a DataFrame by shape and contents for Streamlit caching."""
+    return (df.shape, pd.util.hash_pandas_object(df, index=False).sum())
+
+@st.cache_data(hash_funcs={pd.DataFrame: _hash_dataframe}, max_entries=4)
+def _prepare_daily_bookings(df_combined):
+    """Filter Euston bookings and aggregate them into daily totals."""
+    # Filter for Euston station by comparing categorical codes
+    stations = df_combined['station_code'].cat
+    if 'EUS' in stations.categories:
+        is_euston = stations.codes == stations.categories.get_loc('EUS')
+    else:
+        is_euston = np.zeros(len(df_combined), dtype=bool)
+    
+    # Dates are already parsed by process_datasets; select only that column
+    dates = df_combined.loc[is_euston, 'scheduled_departure_date']
+    
+    # Aggregate bookings by date (unparsed dates are dropped); the year follows from the date
+    daily_bookings = (
+        dates.value_counts(sort=False).sort_index()
+        .rename_axis('scheduled_departure_date')
+        .reset_index(name='total_bookings')
+    )
+    daily_bookings.insert(1, 'year', daily_bookings['scheduled_departure_date'].dt.year)
+    return daily_bookings
+
+def _prophet_training_data(daily_bookings):
+    """Build the ±1σ filtered Prophet frame (ds, y) from daily bookings."""
+    # Daily bookings already hold one row per date, so no further aggregation is needed
+    prophet_data = daily_bookings[['scheduled_departure_date', 'total_bookings']].rename(
+        columns={'scheduled_departure_date': 'ds', 'total_bookings': 'y'}
+    )
+    
+    # Apply empirical bounds (±1σ) to reduce noise for Prophet
+    y = prophet_data['y'].to_numpy()
+    return prophet_data[np.abs(y - y.mean()) <= y.std(ddof=1)]
+
+@st.cache_resource(hash_funcs={pd.DataFrame: _hash_dataframe}, max_entries=4)
+def _fit_prophet(train_df):
+    """Fit the Prophet model used to derive the annual growth factor."""
+    from prophet import Prophet
+    
+    # Only the point forecast (yhat) is used, so skip uncertainty sampling
+    model_prophet = Prophet(
+        weekly_seasonality=True,
+        yearly_seasonality=True,
+        daily_seasonality=False,
+        uncertainty_samples=0,
+        mcmc_samples=0
+    )
+    model_prophet.fit(train_df)
+    return model_prophet
+
 def train_demand_model(df_combined):
     """Train RandomForest model with Prophet-based dynamic growth factor."""
     if df_combined is None:
         return None, None, None
     
     try:
-        # Filter for Euston station
-        df_euston = df_combined[df_combined['station_code'] == "EUS"].copy()
-        
-        # Convert dates
-        df_euston['scheduled_departure_date'] = pd.to_datetime(
-            df_euston['scheduled_departure_date'], 
-            dayfirst=True, 
-            errors='coerce'
-        )
-        df_euston = df_euston.dropna(subset=['scheduled_departure_date'])
-        
-        # Aggregate bookings by date and year
-        daily_bookings = df_euston.groupby(['scheduled_departure_date', 'year']).size().reset_index(name='total_bookings')
+        # Daily Euston bookings (cached across reruns)
+        daily_bookings = _prepare_daily_bookings(df_combined)
         
         # Find the newest year and check if it's complete
         newest_year = daily_bookings['year'].max()
@@ -162,23 +302,8 @@ def train_demand_model(df_combined):
         
         if not is_complete_year and len(daily_bookings['year'].unique()) >= 2:
             try:
-                # Import Prophet
-                from prophet import Prophet
-                
                 # Prepare Prophet data
-                prophet_data = daily_bookings.groupby('scheduled_departure_date')['total_bookings'].sum().reset_index()
-                prophet_data.columns = ['ds', 'y']
-                
-                # Apply empirical bounds (±1σ) to reduce noise for Prophet
-                mean_bookings = prophet_data['y'].mean()
-                std_bookings = prophet_data['y'].std()
-                lower_bound = mean_bookings - std_bookings
-                upper_bound = mean_bookings + std_bookings
-                
-                prophet_data = prophet_data[
-                    (prophet_data['y'] >= lower_bound) & 
-                    (prophet_data['y'] <= upper_bound)
-                ]
+                prophet_data = _prophet_training_data(daily_bookings)
                 
                 st.write(f"📈 **Prophet Training Data:** {len(prophet_data)} days (after ±1σ filtering)")
                 
@@ -188,23 +313,18 @@ def train_demand_model(df_combined):
                 test_prophet = prophet_data[prophet_data['ds'] >= cutoff_date]
                 
                 if len(train_prophet) > 365:  # Need sufficient training data
-                    # Train Prophet model
-                    model_prophet = Prophet(
-                        weekly_seasonality=True,
-                        yearly_seasonality=True,
-                        daily_seasonality=False
-                    )
-                    model_prophet.fit(train_prophet)
+                    # Train Prophet model (reused across reruns with the same data)
+                    model_prophet = _fit_prophet(train_prophet)
                     
-                    # Create future dataframe for newest year
-                    future_newest = model_prophet.make_future_dataframe(periods=365)
-                    forecast = model_prophet.predict(future_newest)
+                    # Forecast every day of the previous and newest years
+                    prev_year = newest_year - 1
+                    future = pd.DataFrame({'ds': pd.date_range(f'{prev_year}-01-01', f'{newest_year}-12-31')})
+                    forecast = model_prophet.predict(future)
                     
                     # Calculate growth factor from Prophet predictions
-                    forecast['year'] = pd.to_datetime(forecast['ds']).dt.year
-                    annual_avg = forecast.groupby('year')['yhat'].mean()
+                    forecast['year'] = forecast['ds'].dt.year.astype(np.int16)
+                    annual_avg = forecast.groupby('year', sort=False)['yhat'].mean()
                     
-                    prev_year = newest_year - 1
                     if prev_year in annual_avg.index and newest_year in annual_avg.index:
                         growth_factor = annual_avg[newest_year] / annual_avg[prev_year]
                         
@@ -226,71 +346,52 @@ def train_demand_model(df_combined):
             growth_factor = 1.0 if is_complete_year else 1.18
             st.info(f"📈 **Growth Factor:** {growth_factor:.3f} ({'Complete year' if is_complete_year else 'Fallback'})")
         
-        # Prepare training data with empirical bounds (±1σ)
-        daily_bookings['day_of_week'] = daily_bookings['scheduled_departure_date'].dt.day_name()
+        # Prepare training data with empirical bounds (±1σ); day of week as an integer code (Monday=0)
+        daily_bookings['dow'] = daily_bookings['scheduled_departure_date'].dt.dayofweek.astype(np.int8)
         
         # Apply empirical bounds to reduce noise
-        mean_bookings = daily_bookings['total_bookings'].mean()
-        std_bookings = daily_bookings['total_bookings'].std()
+        total_bookings = daily_bookings['total_bookings'].to_numpy()
+        mean_bookings = total_bookings.mean()
+        std_bookings = total_bookings.std(ddof=1)
         lower_bound = mean_bookings - std_bookings
         upper_bound = mean_bookings + std_bookings
         
         st.write(f"📊 **Training Data Empirical Bounds (μ ± 1σ):** {lower_bound:.1f} to {upper_bound:.1f}")
         
-        daily_bookings_filtered = daily_bookings[
-            (daily_bookings['total_bookings'] >= lower_bound) & 
-            (daily_bookings['total_bookings'] <= upper_bound)
-        ]
+        daily_bookings_filtered = daily_bookings[np.abs(total_bookings - mean_bookings) <= std_bookings]
         
         # Train RandomForest on filtered data
-        daily_bookings_encoded = pd.get_dummies(daily_bookings_filtered, columns=['day_of_week'], drop_first=True)
-        
-        features = ['year'] + [col for col in daily_bookings_encoded.columns if col.startswith('day_of_week_')]
-        X = daily_bookings_encoded[features]
-        y = daily_bookings_encoded['total_bookings']
+        X = daily_bookings_filtered[['year', 'dow']].to_numpy(dtype=np.float32)
+        y = daily_bookings_filtered['total_bookings'].to_numpy(dtype=np.float32)
         
         # Train model on all filtered data
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
+        model = RandomForestRegressor(
+            n_estimators=100,
+            random_state=42,
+            n_jobs=-1,
+            max_features='sqrt',
+            oob_score=True,
+            bootstrap=True
+        )
         model.fit(X, y)
         
-        # Calculate metrics using cross-validation approach
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        model_test = RandomForestRegressor(n_estimators=100, random_state=42)
-        model_test.fit(X_train, y_train)
-        y_pred = model_test.predict(X_test)
+        # Calculate metrics from out-of-bag predictions (each sample scored by trees that did not see it)
+        y_pred = model.oob_prediction_
         
-        mae = mean_absolute_error(y_test, y_pred)
-        rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-        mape = np.mean(np.abs((y_test - y_pred) / y_test)) * 100
+        mae = mean_absolute_error(y, y_pred)
+        rmse = np.sqrt(mean_squared_error(y, y_pred))
+        mape = mean_absolute_percentage_error(y, y_pred) * 100
         
         metrics = {'mae': mae, 'rmse': rmse, 'mape': mape, 'growth_factor': growth_factor}
         
         # Generate predictions for target year (newest year + 1 if incomplete, or newest year if complete)
         target_year = newest_year if is_complete_year else newest_year + 1
         
-        predictions = {}
-        for day in DAYS_OF_WEEK:
-            # Create feature vector for target year
-            feature_vector = pd.DataFrame({'year': [target_year]})
-            
-            # Add day of week dummy variables
-            for col in features[1:]:  # Skip 'year'
-                if col == f'day_of_week_{day}':
-                    feature_vector[col] = 1
-                else:
-                    feature_vector[col] = 0
-            
-            # Ensure all columns are present
-            for col in features:
-                if col not in feature_vector.columns:
-                    feature_vector[col] = 0
-            
-            # Reorder columns to match training data
-            feature_vector = feature_vector[features]
-            
-            # Predict and apply growth factor
-            prediction = model.predict(feature_vector)[0] * growth_factor
-            predictions[day] = int(round(prediction))
+        # Predict all 7 days (dayofweek 0-6) in one call and apply growth factor
+        X_pred = np.array([[target_year, d] for d in range(7)], dtype=np.float32)
+        preds = np.rint(model.predict(X_pred) * growth_factor).astype(int)
+        
+        predictions = {day: int(preds[code]) for day, code in DAYOFWEEK_CODES.items()}
         
         st.success(f"✅ **Model Trained Successfully!**\n"
                   f"📅 **Target Year:** {target_year}\n"
@@ -332,6 +433,18 @@ def parse_time_format(time_str):
     
     return None
 
+def parse_time_ranges(time_info):
+    """Parse a Series of 'HHMM-HHMM' ranges into HH:MM start and end columns."""
+    parts = time_info.str.extract(r'^\s*(\d{3,4})\s*-\s*(\d{3,4})\s*$')
+    start = parts[0].str.zfill(4)
+    end = parts[1].str.zfill(4)
+    
+    # Ranges in any other format are left as NaN
+    return pd.DataFrame({
+        'start': start.str[:2] + ':' + start.str[2:],
+        'end': end.str[:2] + ':' + end.str[2:]
+    })
+
 def parse_roster_csv(uploaded_file):
     """Parse the uploaded CSV roster file with the correct format."""
     try:
@@ -339,10 +452,12 @@ def parse_roster_csv(uploaded_file):
         df = pd.read_csv(uploaded_file)
         
         # Debug: Show the structure of the uploaded file
-        st.write("**Debug: File structure**")
-        st.write(f"Columns: {list(df.columns)}")
-        st.write("Sample data:")
-        st.dataframe(df.head(10))
+        debug = st.session_state.get('debug', False)
+        if debug:
+            st.write("**Debug: File structure**")
+            st.write(f"Columns: {list(df.columns)}")
+            st.write("Sample data:")
+            st.dataframe(df.head(10))
         
         roster_data = {}
         
@@ -360,72 +475,82 @@ def parse_roster_csv(uploaded_file):
             roster_data[day] = []
         
         # Process the data - your format has staff names in first column and alternating time/shift rows
-        i = 0
-        while i < len(df):
-            # Get the staff member name from the first column
-            staff_name = str(df.iloc[i, 0]).strip() if not pd.isna(df.iloc[i, 0]) else ""
-            
-            # Skip empty rows or header rows
-            if not staff_name or staff_name == 'nan' or ',' in staff_name:
-                i += 1
-                continue
-            
-            # Get the time row (current row)
-            time_row = df.iloc[i]
-            
-            # Get the shift code row (next row if it exists)
-            shift_row = None
-            if i + 1 < len(df):
-                next_row_name = str(df.iloc[i + 1, 0]).strip() if not pd.isna(df.iloc[i + 1, 0]) else ""
-                # If next row doesn't have a staff name, it's probably the shift codes
-                if not next_row_name or next_row_name == 'nan':
-                    shift_row = df.iloc[i + 1]
-                    i += 2  # Skip both rows
-                else:
-                    i += 1  # Only skip current row
-            else:
-                i += 1
-            
-            # Process each day column
-            for day in day_columns:
-                if day not in df.columns:
-                    continue
-                
-                # Get time info and shift code
-                time_info = str(time_row[day]).strip() if not pd.isna(time_row[day]) else ""
-                shift_code = ""
-                if shift_row is not None:
-                    shift_code = str(shift_row[day]).strip() if not pd.isna(shift_row[day]) else ""
-                
-                # Skip if OFF, SPARE, RD, or empty
-                if time_info in ['OFF', 'SPARE', 'RD', '', 'nan', 'Vacancy']:
-                    continue
-                
-                # Parse time range (e.g., "1500-2300" or "0630-1430")
-                if '-' in time_info:
+        names = df.iloc[:, 0].fillna('').astype(str).str.strip()
+        blank_name = names.isin(['', 'nan']).to_numpy()
+        
+        # Skip empty rows or header rows
+        is_staff = ~blank_name & ~names.str.contains(',', regex=False).to_numpy()
+        staff_idx = np.flatnonzero(is_staff)
+        
+        # The shift codes are in the next row when it has no staff name
+        code_idx = staff_idx + 1
+        has_shift_row = code_idx < len(df)
+        has_shift_row[has_shift_row] = blank_name[code_idx[has_shift_row]]
+        
+        day_values = df[day_columns].to_numpy(dtype=object)
+        time_values = day_values[staff_idx]
+        code_values = np.where(has_shift_row[:, None], day_values[np.minimum(code_idx, len(df) - 1)], '')
+        
+        # One row per day and staff member, in roster order within each day
+        cells = pd.DataFrame({
+            'staff_name': np.tile(names.to_numpy()[staff_idx], len(day_columns)),
+            'day': np.repeat(day_columns, len(staff_idx)),
+            'time_info': time_values.T.ravel(),
+            'shift_code': code_values.T.ravel()
+        })
+        
+        time_info = cells['time_info'].fillna('').astype(str).str.strip()
+        shift_code = cells['shift_code'].fillna('').astype(str).str.strip()
+        
+        # Skip if OFF, SPARE, RD, or empty
+        working = ~time_info.isin(NON_WORKING_ENTRIES)
+        is_range = working & time_info.str.contains('-', regex=False)
+        is_default = working & ~is_range & shift_code.isin(list(DEFAULT_SHIFTS))
+        
+        # Parse time ranges (e.g., "1500-2300" or "0630-1430") in one pass
+        shift_times = parse_time_ranges(time_info[is_range]).reindex(cells.index)
+        
+        # Collect debug rows and parse failures, shown once after the loop
+        debug_rows = []
+        unparsed = []
+        
+        selected = is_range | is_default
+        for staff_name, day, info, code, ranged, start_time, end_time in zip(
+            cells.loc[selected, 'staff_name'],
+            cells.loc[selected, 'day'],
+            time_info[selected],
+            shift_code[selected],
+            is_range[selected],
+            shift_times.loc[selected, 'start'],
+            shift_times.loc[selected, 'end']
+        ):
+            if ranged:
+                # Fall back to the general parser for other range formats
+                if pd.isna(start_time):
                     try:
-                        start_time_str, end_time_str = time_info.split('-')
-                        start_time = parse_time_format(start_time_str)
-                        end_time = parse_time_format(end_time_str)
-                        
-                        if start_time and end_time:
-                            roster_data[day].append((start_time, end_time))
-                            st.write(f"Added shift for {staff_name} on {day}: {start_time} - {end_time}")
-                            
-                    except ValueError as e:
-                        st.write(f"Could not parse time range '{time_info}' for {staff_name} on {day}: {e}")
+                        start_time_str, end_time_str = info.split('-')
+                    except ValueError:
+                        unparsed.append(f"'{info}' for {staff_name} on {day}")
                         continue
+                    start_time = parse_time_format(start_time_str)
+                    end_time = parse_time_format(end_time_str)
                 
-                # Handle standalone shift codes (fallback)
-                elif shift_code in ['8', '10'] and time_info not in ['OFF', 'SPARE', 'RD', '', 'nan']:
-                    if shift_code == '8':
-                        # Default 8-hour shift: 06:30-14:30
-                        roster_data[day].append(('06:30', '14:30'))
-                        st.write(f"Added default 8h shift for {staff_name} on {day}: 06:30 - 14:30")
-                    elif shift_code == '10':
-                        # Default 10-hour shift: 06:30-16:30
-                        roster_data[day].append(('06:30', '16:30'))
-                        st.write(f"Added default 10h shift for {staff_name} on {day}: 06:30 - 16:30")
+                if start_time and end_time:
+                    roster_data[day].append((start_time, end_time))
+                    debug_rows.append((staff_name, day, start_time, end_time))
+            
+            # Handle standalone shift codes (fallback)
+            else:
+                start_time, end_time = DEFAULT_SHIFTS[code]
+                roster_data[day].append((start_time, end_time))
+                debug_rows.append((staff_name, day, start_time, end_time))
+        
+        if unparsed:
+            st.warning(f"⚠️ Could not parse {len(unparsed)} time range(s): {', '.join(unparsed)}")
+        
+        if debug:
+            st.write("**Debug: Added shifts**")
+            st.dataframe(pd.DataFrame(debug_rows, columns=['Staff', 'Day', 'Start', 'End']))
         
         # Show parsed results
         st.write("**Parsed roster summary:**")
@@ -462,117 +587,132 @@ def parse_roster_csv(uploaded_file):
         st.write("4. Staff names should be in the first column")
         return None
 
+@st.cache_data(hash_funcs={pd.DataFrame: _hash_dataframe}, max_entries=4)
 def analyse_bank_holiday_patterns(df_combined):
     """Analyse bank holiday patterns and generate predictions."""
     if df_combined is None:
-        return None
+        return None, None, None
     
     try:
-        # Filter for Euston station
-        df_euston = df_combined[df_combined['station_code'] == "EUS"].copy()
+        # Bookings by date (one row per date)
+        daily_bookings = (
+            _prepare_daily_bookings(df_combined)[['scheduled_departure_date', 'total_bookings']]
+            .rename(columns={'total_bookings': 'bookings'})
+        )
         
-        # Convert dates
-        df_euston['scheduled_departure_date'] = pd.to_datetime(
-            df_euston['scheduled_departure_date'], 
-            dayfirst=True, 
-            errors='coerce'
+        # Calculate normal day averages for comparison, grouped by dayofweek (Monday=0)
+        dayofweek = daily_bookings['scheduled_departure_date'].dt.dayofweek
+        grouped = daily_bookings['bookings'].groupby(dayofweek, sort=False)
+        
+        # Apply ±1σ filter, falling back to the plain mean if nothing is within bounds
+        mean_val = grouped.transform('mean')
+        std_val = grouped.transform('std')
+        within_bounds = daily_bookings['bookings'].between(mean_val - std_val, mean_val + std_val)
+        day_means = (
+            daily_bookings['bookings'][within_bounds].groupby(dayofweek[within_bounds], sort=False).mean()
+            .combine_first(grouped.mean())
         )
-        df_euston = df_euston.dropna(subset=['scheduled_departure_date'])
         
-        # Aggregate bookings by date
-        daily_bookings = df_euston.groupby('scheduled_departure_date').size().reset_index(name='bookings')
-        daily_bookings['day_of_week'] = daily_bookings['scheduled_departure_date'].dt.day_name()
+        normal_by_dayofweek = np.zeros(7)
+        normal_by_dayofweek[day_means.index] = day_means.to_numpy()
         
-        # Calculate normal day averages for comparison
-        normal_averages = {}
-        for day in DAYS_OF_WEEK:
-            day_data = daily_bookings[daily_bookings['day_of_week'] == day]['bookings']
-            if len(day_data) > 0:
-                # Apply ±1σ filter
-                mean_val = day_data.mean()
-                std_val = day_data.std()
-                filtered_data = day_data[(day_data >= mean_val - std_val) & (day_data <= mean_val + std_val)]
-                normal_averages[day] = filtered_data.mean() if len(filtered_data) > 0 else mean_val
+        normal_averages = {
+            day: day_means[code]
+            for day, code in DAYOFWEEK_CODES.items()
+            if code in day_means.index
+        }
+        
+        # Index bookings by date once so each lookup is a hash probe rather than a scan
+        date_index = pd.DatetimeIndex(daily_bookings['scheduled_departure_date'])
+        bookings = daily_bookings['bookings'].to_numpy()
+        day_names = DAY_NAMES_BY_CODE[dayofweek.to_numpy()]
+        
+        # Holiday periods covered by the data
+        holidays = _HOLIDAY_INDEX[_HOLIDAY_INDEX['year'] <= date_index.year.max()]
+        periods = list(holidays.itertuples(index=False))
+        
+        # Get pre and post days, looked up for all holidays in one batch
+        pre_dates = pd.DatetimeIndex(holidays['start']) - timedelta(days=1)
+        post_dates = pd.DatetimeIndex(holidays['end']) + timedelta(days=1)
+        pre_positions = date_index.get_indexer(pre_dates)
+        post_positions = date_index.get_indexer(post_dates)
+        
+        # Percentage difference vs a normal day for all pre/post days at once (0 if no normal);
+        # entries for days missing from the data (position -1) are never read
+        pre_normals = normal_by_dayofweek[pre_dates.dayofweek]
+        post_normals = normal_by_dayofweek[post_dates.dayofweek]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pre_pcts = np.where(pre_normals > 0, (bookings[pre_positions] - pre_normals) / pre_normals * 100, 0.0)
+            post_pcts = np.where(post_normals > 0, (bookings[post_positions] - post_normals) / post_normals * 100, 0.0)
         
         # Analyse each bank holiday
         bank_holiday_analysis = []
+        flat_rows = []
         
-        for year, holidays in UK_BANK_HOLIDAYS.items():
-            if year > daily_bookings['scheduled_departure_date'].dt.year.max():
-                continue
-                
-            for holiday_name, dates in holidays.items():
-                if isinstance(dates, tuple):
-                    start_date, end_date = dates
-                    start_date = pd.to_datetime(start_date)
-                    end_date = pd.to_datetime(end_date)
-                else:
-                    start_date = end_date = pd.to_datetime(dates)
-                
-                # Get pre and post days
-                pre_date = start_date - timedelta(days=1)
-                post_date = end_date + timedelta(days=1)
-                
-                # Get data for each period
-                analysis = {
-                    'holiday_name': holiday_name,
-                    'year': year,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'pre_date': pre_date,
-                    'post_date': post_date,
-                    'holiday_bookings': {},
-                    'pre_booking': None,
-                    'post_booking': None
+        for i, (holiday_name, year, start_date, end_date) in enumerate(periods):
+            pre_date = pre_dates[i]
+            post_date = post_dates[i]
+            
+            # Get data for each period
+            analysis = {
+                'holiday_name': holiday_name,
+                'year': year,
+                'start_date': start_date,
+                'end_date': end_date,
+                'pre_date': pre_date,
+                'post_date': post_date,
+                'holiday_bookings': {},
+                'pre_booking': None,
+                'post_booking': None
+            }
+            
+            # Pre-day analysis
+            pre_pos = pre_positions[i]
+            if pre_pos >= 0:
+                pre_booking = bookings[pre_pos]
+                pre_day = day_names[pre_pos]
+                analysis['pre_booking'] = {
+                    'date': pre_date,
+                    'day': pre_day,
+                    'bookings': pre_booking,
+                    'percentage_diff': pre_pcts[i]
                 }
-                
-                # Pre-day analysis
-                pre_data = daily_bookings[daily_bookings['scheduled_departure_date'] == pre_date]
-                if len(pre_data) > 0:
-                    pre_booking = pre_data['bookings'].iloc[0]
-                    pre_day = pre_data['day_of_week'].iloc[0]
-                    normal_pre = normal_averages.get(pre_day, 0)
-                    pre_pct = ((pre_booking - normal_pre) / normal_pre * 100) if normal_pre > 0 else 0
-                    analysis['pre_booking'] = {
-                        'date': pre_date,
-                        'day': pre_day,
-                        'bookings': pre_booking,
-                        'percentage_diff': pre_pct
-                    }
-                
-                # Holiday period analysis
-                current_date = start_date
-                while current_date <= end_date:
-                    holiday_data = daily_bookings[daily_bookings['scheduled_departure_date'] == current_date]
-                    if len(holiday_data) > 0:
-                        analysis['holiday_bookings'][current_date] = {
-                            'bookings': holiday_data['bookings'].iloc[0],
-                            'day': holiday_data['day_of_week'].iloc[0]
-                        }
-                    current_date += timedelta(days=1)
-                
-                # Post-day analysis
-                post_data = daily_bookings[daily_bookings['scheduled_departure_date'] == post_date]
-                if len(post_data) > 0:
-                    post_booking = post_data['bookings'].iloc[0]
-                    post_day = post_data['day_of_week'].iloc[0]
-                    normal_post = normal_averages.get(post_day, 0)
-                    post_pct = ((post_booking - normal_post) / normal_post * 100) if normal_post > 0 else 0
-                    analysis['post_booking'] = {
-                        'date': post_date,
-                        'day': post_day,
-                        'bookings': post_booking,
-                        'percentage_diff': post_pct
+            
+            # Holiday period analysis
+            holiday_dates = pd.date_range(start_date, end_date, freq='D')
+            for current_date, pos in zip(holiday_dates, date_index.get_indexer(holiday_dates)):
+                if pos >= 0:
+                    analysis['holiday_bookings'][current_date] = {
+                        'bookings': bookings[pos],
+                        'day': day_names[pos]
                     }
-                
-                if analysis['holiday_bookings']:  # Only add if we have holiday data
-                    bank_holiday_analysis.append(analysis)
+            
+            # Post-day analysis
+            post_pos = post_positions[i]
+            if post_pos >= 0:
+                post_booking = bookings[post_pos]
+                post_day = day_names[post_pos]
+                analysis['post_booking'] = {
+                    'date': post_date,
+                    'day': post_day,
+                    'bookings': post_booking,
+                    'percentage_diff': post_pcts[i]
+                }
+            
+            if analysis['holiday_bookings']:  # Only add if we have holiday data
+                bank_holiday_analysis.append(analysis)
+                for current_date, booking_data in analysis['holiday_bookings'].items():
+                    flat_rows.append((holiday_name, current_date, current_date.month, current_date.day,
+                                      year, booking_data['bookings']))
+        
+        # One row per holiday date, for lookups by calendar day
+        bh_flat = pd.DataFrame(flat_rows, columns=['holiday_name', 'date', 'month', 'day', 'year', 'bookings'])
         
-        return bank_holiday_analysis, normal_averages
+        return bank_holiday_analysis, normal_averages, bh_flat
         
     except Exception as e:
         st.error(f"Error analysing bank holiday patterns: {str(e)}")
-        return None, None
+        return None, None, None
 
 def predict_bank_holiday_demand(df_combined, target_date):
     """Predict demand for a specific bank holiday using Prophet-based growth factor."""
@@ -581,39 +721,33 @@ def predict_bank_holiday_demand(df_combined, target_date):
     
     try:
         # Get bank holiday analysis
-        bank_holiday_analysis, normal_averages = analyse_bank_holiday_patterns(df_combined)
+        bank_holiday_analysis, normal_averages, bh_flat = analyse_bank_holiday_patterns(df_combined)
         if not bank_holiday_analysis:
             return None
         
         # Find which bank holiday the target_date falls into
         target_pd = pd.to_datetime(target_date)
-        matching_holiday = None
+        target_np = target_pd.to_datetime64()
+        matches = np.flatnonzero((_HOLIDAY_STARTS <= target_np) & (target_np <= _HOLIDAY_ENDS))
         
-        for year, holidays in UK_BANK_HOLIDAYS.items():
-            for holiday_name, dates in holidays.items():
-                if isinstance(dates, tuple):
-                    start_date, end_date = dates
-                    start_date = pd.to_datetime(start_date)
-                    end_date = pd.to_datetime(end_date)
-                else:
-                    start_date = end_date = pd.to_datetime(dates)
-                
-                if start_date <= target_pd <= end_date:
-                    matching_holiday = {
-                        'name': holiday_name,
-                        'year': year,
-                        'start': start_date,
-                        'end': end_date
-                    }
-                    break
+        matching_holiday = None
+        if len(matches) > 0:
+            holiday = _HOLIDAY_INDEX.iloc[matches[0]]
+            matching_holiday = {
+                'name': holiday['name'],
+                'year': int(holiday['year']),
+                'start': holiday['start'],
+                'end': holiday['end']
+            }
         
         if not matching_holiday:
             return None
         
         # Find historical patterns for this holiday type
+        holiday_type = matching_holiday['name'].replace(f" {matching_holiday['year']}", "")
         holiday_patterns = []
         for analysis in bank_holiday_analysis:
-            if matching_holiday['name'].replace(f" {matching_holiday['year']}", "") in analysis['holiday_name']:
+            if holiday_type in analysis['holiday_name']:
                 holiday_patterns.append(analysis)
         
         if not holiday_patterns:
@@ -622,38 +756,21 @@ def predict_bank_holiday_demand(df_combined, target_date):
         # Calculate Prophet-based growth factor
         growth_factor = 1.0
         try:
-            from prophet import Prophet
-            
-            # Prepare data for Prophet
-            df_euston = df_combined[df_combined['station_code'] == "EUS"].copy()
-            df_euston['scheduled_departure_date'] = pd.to_datetime(
-                df_euston['scheduled_departure_date'], dayfirst=True, errors='coerce'
-            )
-            df_euston = df_euston.dropna(subset=['scheduled_departure_date'])
-            
-            daily_bookings = df_euston.groupby('scheduled_departure_date').size().reset_index()
-            daily_bookings.columns = ['ds', 'y']
+            # Prepare data for Prophet (shares the cached daily aggregation)
+            daily_bookings = _prophet_training_data(_prepare_daily_bookings(df_combined))
             
-            # Apply empirical bounds
-            mean_bookings = daily_bookings['y'].mean()
-            std_bookings = daily_bookings['y'].std()
-            daily_bookings = daily_bookings[
-                (daily_bookings['y'] >= mean_bookings - std_bookings) & 
-                (daily_bookings['y'] <= mean_bookings + std_bookings)
-            ]
-            
-            # Train Prophet
-            newest_year = daily_bookings['ds'].dt.year.max()
-            train_data = daily_bookings[daily_bookings['ds'].dt.year < newest_year]
+            # Train Prophet (same training window as train_demand_model, so the fit is reused)
+            years = daily_bookings['ds'].dt.year.astype(np.int16)
+            newest_year = years.max()
+            train_data = daily_bookings[years < newest_year]
             
             if len(train_data) > 365:
-                model_prophet = Prophet(weekly_seasonality=True, yearly_seasonality=True)
-                model_prophet.fit(train_data)
+                model_prophet = _fit_prophet(train_data)
                 
                 # Calculate growth factor
                 forecast = model_prophet.predict(daily_bookings[['ds']])
-                forecast['year'] = forecast['ds'].dt.year
-                annual_avg = forecast.groupby('year')['yhat'].mean()
+                forecast['year'] = forecast['ds'].dt.year.astype(np.int16)
+                annual_avg = forecast.groupby('year', sort=False)['yhat'].mean()
                 
                 if newest_year in annual_avg.index and (newest_year - 1) in annual_avg.index:
                     growth_factor = annual_avg[newest_year] / annual_avg[newest_year - 1]
@@ -662,18 +779,27 @@ def predict_bank_holiday_demand(df_combined, target_date):
             growth_factor = 1.18  # Fallback
         
         # Calculate predictions based on historical patterns
-        predictions = {}
-        for pattern in holiday_patterns:
-            for date, booking_data in pattern['holiday_bookings'].items():
-                if date.day == target_pd.day and date.month == target_pd.month:
-                    base_demand = booking_data['bookings']
-                    predicted_demand = int(round(base_demand * growth_factor))
-                    predictions[date] = {
-                        'historical_demand': base_demand,
-                        'predicted_demand': predicted_demand,
-                        'growth_factor': growth_factor,
-                        'year': pattern['year']
-                    }
+        rows = bh_flat.loc[
+            bh_flat['holiday_name'].str.contains(holiday_type, regex=False)
+            & (bh_flat['month'] == target_pd.month)
+            & (bh_flat['day'] == target_pd.day)
+        ]
+        
+        base_arr = rows['bookings'].to_numpy(dtype=np.float64)
+        pred_arr = np.rint(base_arr * growth_factor).astype(np.int64)
+        
+        predictions = pd.DataFrame(
+            {
+                'historical_demand': rows['bookings'].to_numpy(),
+                'predicted_demand': pred_arr,
+                'growth_factor': growth_factor,
+                'year': rows['year'].to_numpy()
+            },
+            index=pd.DatetimeIndex(rows['date'], name='date')
+        )
+        
+        # A date matched by more than one holiday period keeps the last match
+        predictions = predictions[~predictions.index.duplicated(keep='last')]
         
         return {
             'holiday': matching_holiday,
@@ -687,10 +813,25 @@ def predict_bank_holiday_demand(df_combined, target_date):
         return None
 
 def time_to_minutes(time_str):
-    """Convert HH:MM time string to minutes since midnight."""
+    """Convert HH:MM (or HHMM) time string to minutes since midnight."""
+    minutes = _MIN_OF.get(time_str)
+    if minutes is not None:
+        return minutes
+    return _parse_fallback(time_str)
+
+@functools.lru_cache(maxsize=128)
+def _parse_fallback(time_str):
+    """Convert time strings missing from the quarter-hour table to minutes since midnight."""
+    if time_str and len(time_str) == 4 and time_str.isdigit():
+        return int(time_str[:2]) * 60 + int(time_str[2:])
+    
     if not time_str or ':' not in time_str:
         return 0
     
+    # Fast path for the fixed-width HH:MM format used throughout the app
+    if len(time_str) == 5 and time_str[2] == ':' and time_str[:2].isdigit() and time_str[3:].isdigit():
+        return (ord(time_str[0]) - 48) * 600 + (ord(time_str[1]) - 48) * 60 + (ord(time_str[3]) - 48) * 10 + (ord(time_str[4]) - 48)
+    
     try:
         hours, minutes = map(int, time_str.split(':'))
         return hours * 60 + minutes
@@ -699,72 +840,79 @@ def time_to_minutes(time_str):
 
 def get_operational_hours(day_of_week):
     """Get operational hours based on day of week."""
-    if day_of_week == 'Sunday':
-        return OPERATIONAL_HOURS_SUNDAY
-    else:
-        return OPERATIONAL_HOURS_WEEKDAY
+    return _HOURS_BY_DAY.get(day_of_week, OPERATIONAL_HOURS_WEEKDAY)
+
+# Hourly results as both an hour-keyed dict and an array aligned with the operational hours
+HourlyValues = namedtuple('HourlyValues', ['by_hour', 'values'])
+
+@st.cache_data(show_spinner=False)
+def _roster_to_minute_arrays(roster_items):
+    """Convert (day, shifts) roster items to per-day shift start/end minute arrays."""
+    roster_min_arrays = {}
+    for day, shifts in roster_items:
+        starts = np.array([time_to_minutes(start) for start, _ in shifts], dtype=np.int16)
+        ends = np.array([time_to_minutes(end) for _, end in shifts], dtype=np.int16)
+        roster_min_arrays[day] = (starts, ends)
+    return roster_min_arrays
 
-def calculate_hourly_coverage(roster_data, selected_day):
-    """Calculate hourly staff coverage for a given day with improved time handling."""
-    if not roster_data or selected_day not in roster_data:
+def calculate_hourly_coverage(roster_min_arrays, selected_day, operational_hours=None):
+    """Calculate hourly staff coverage for a given day from shift start/end minute arrays."""
+    if not roster_min_arrays or selected_day not in roster_min_arrays:
+        coverage = _ZERO_COV_BY_DAY.get(selected_day, _ZERO_COV_WEEKDAY).copy()
+        return HourlyValues(coverage, np.zeros(len(coverage), dtype=np.int64))
+    
+    if operational_hours is None:
         operational_hours = get_operational_hours(selected_day)
-        return {hour: 0 for hour in operational_hours}
+    hours = _MIN_BY_DAY.get(selected_day, OPERATIONAL_MIN_WEEKDAY)
     
-    operational_hours = get_operational_hours(selected_day)
-    coverage = {hour: 0 for hour in operational_hours}
+    starts, ends = roster_min_arrays[selected_day]
     
-    for start_time, end_time in roster_data[selected_day]:
-        # Convert times to minutes for accurate comparison
-        start_minutes = time_to_minutes(start_time)
-        end_minutes = time_to_minutes(end_time)
-        
-        # Count staff for each operational hour
-        for hour_str in operational_hours:
-            hour_minutes = time_to_minutes(hour_str)
-            
-            # Check if this hour falls within the shift
-            # A shift covers an hour if the hour is >= start and < end
-            if start_minutes <= hour_minutes < end_minutes:
-                coverage[hour_str] += 1
+    # A shift covers an hour if the hour is >= start and < end
+    counts = ((hours[:, None] >= starts[None, :]) & (hours[:, None] < ends[None, :])).sum(axis=1)
     
-    return coverage
+    return HourlyValues(dict(zip(operational_hours, counts.tolist())), counts)
 
-def calculate_hourly_demand(total_customers, day_of_week, hourly_pattern=None):
+def calculate_hourly_demand(total_customers, day_of_week, hourly_pattern=None, operational_hours=None):
     """Calculate hourly customer demand based on day of week."""
-    operational_hours = get_operational_hours(day_of_week)
+    if operational_hours is None:
+        operational_hours = get_operational_hours(day_of_week)
     
     if hourly_pattern is None:
-        if day_of_week == 'Sunday':
-            hourly_pattern = HOURLY_PATTERNS['Sunday']
-        else:
-            hourly_pattern = HOURLY_PATTERNS['Weekday']
+        pattern = _PATTERN_BY_DAY.get(day_of_week, HOURLY_PATTERNS_ARR['Weekday'])
+    else:
+        pattern = np.array([hourly_pattern.get(hour, 0) for hour in operational_hours], dtype=np.float64)
     
-    return {
-        hour: int(round(total_customers * hourly_pattern.get(hour, 0)))
-        for hour in operational_hours
-    }
+    values = np.rint(total_customers * pattern).astype(np.int32)
+    return HourlyValues(dict(zip(operational_hours, values.tolist())), values)
 
-def generate_recommendations(hourly_demand, hourly_coverage, efficiency=DEFAULT_STAFF_EFFICIENCY):
-    """Generate staffing recommendations based on demand vs coverage."""
-    recommendations = {}
+# Recommendation messages by staffing status: understaffed, overstaffed, adequate
+RECOMMENDATION_TEMPLATES = (
+    "⚠️ Add {diff} staff (Current: {coverage}, Required: {required})",
+    "ℹ️ Excess {diff} staff (Current: {coverage}, Required: {required})",
+    "✅ Adequate (Current: {coverage}, Required: {required})"
+)
+
+def generate_recommendations(demand_arr, coverage_arr, operational_hours, efficiency=DEFAULT_STAFF_EFFICIENCY):
+    """Generate staffing recommendations and status codes based on demand vs coverage."""
+    # Calculate required staff based on efficiency, with at least one staff member per hour
+    required = np.ceil(demand_arr / efficiency).astype(np.int64)
+    required[demand_arr <= 0] = 1
     
-    for hour in hourly_demand.keys():
-        demand = hourly_demand.get(hour, 0)
-        coverage = hourly_coverage.get(hour, 0)
-        
-        # Calculate required staff based on efficiency
-        required_staff = np.ceil(demand / efficiency) if demand > 0 else 1
-        
-        if coverage < required_staff:
-            deficit = int(required_staff - coverage)
-            recommendations[hour] = f"⚠️ Add {deficit} staff (Current: {coverage}, Required: {int(required_staff)})"
-        elif coverage > required_staff * 1.2:  # 20% buffer
-            excess = int(coverage - required_staff)
-            recommendations[hour] = f"ℹ️ Excess {excess} staff (Current: {coverage}, Required: {int(required_staff)})"
-        else:
-            recommendations[hour] = f"✅ Adequate (Current: {coverage}, Required: {int(required_staff)})"
+    # 20% buffer before an hour counts as overstaffed
+    status = np.select([coverage_arr < required, coverage_arr > required * 1.2], [0, 1], default=2).astype(np.int8)
+    diff = np.abs(required - coverage_arr)
     
-    return recommendations
+    recommendations = {}
+    for hour, code, d, coverage, req in zip(operational_hours, status.tolist(), diff.tolist(),
+                                            coverage_arr.tolist(), required.tolist()):
+        recommendations[hour] = RECOMMENDATION_TEMPLATES[code].format(diff=d, coverage=coverage, required=req)
+    
+    return recommendations, status
+
+@st.cache_data(show_spinner=False)
+def _csv_cache(df):
+    """Serialise a DataFrame to CSV bytes for download, cached across reruns."""
+    return df.to_csv(index=False).encode('utf-8')
 
 # Streamlit App
 def main():
@@ -793,6 +941,8 @@ def main():
                 "- Non-working: 'OFF', 'SPARE', 'RD'\n"
                 "- Shift codes in alternating rows (optional)")
         
+        st.checkbox("Show roster parsing details", key='debug')
+        
         roster_file = st.file_uploader(
             "Upload 2025 Roster CSV File",
             type=['csv'],
@@ -803,6 +953,9 @@ def main():
             roster_data = parse_roster_csv(roster_file)
             if roster_data:
                 st.session_state.roster_data = roster_data
+                st.session_state.roster_min_arrays = _roster_to_minute_arrays(
+                    tuple((day, tuple(shifts)) for day, shifts in roster_data.items())
+                )
                 st.success("✅ Roster file loaded successfully!")
                 
                 # Display roster summary
@@ -827,7 +980,7 @@ def main():
         if uploaded_files:
             if st.button("🔄 Train Prediction Model"):
                 with st.spinner("Training model..."):
-                    df_combined = process_datasets(uploaded_files)
+                    df_combined = _combined_dataset(uploaded_files)
                     if df_combined is not None:
                         model, metrics, predictions = train_demand_model(df_combined)
                         if model and metrics and predictions:
@@ -876,9 +1029,9 @@ def main():
         if bank_holiday_files:
             if st.button("🔍 Analyse Bank Holiday Patterns"):
                 with st.spinner("Analysing bank holiday patterns..."):
-                    df_combined_bh = process_datasets(bank_holiday_files)
+                    df_combined_bh = _combined_dataset(bank_holiday_files)
                     if df_combined_bh is not None:
-                        bank_holiday_analysis, normal_averages = analyse_bank_holiday_patterns(df_combined_bh)
+                        bank_holiday_analysis, normal_averages, _ = analyse_bank_holiday_patterns(df_combined_bh)
                         if bank_holiday_analysis:
                             st.session_state.bank_holiday_analysis = bank_holiday_analysis
                             st.session_state.bank_holiday_normals = normal_averages
@@ -960,21 +1113,25 @@ def main():
     if total_customers > 0:
         st.header("📊 Demand vs Roster Analysis")
         
+        operational_hours = get_operational_hours(day_of_week)
+        hours_arr = np.asarray(operational_hours)
+        
         # Calculate hourly demand and coverage
-        hourly_demand = calculate_hourly_demand(total_customers, day_of_week)
+        hourly_demand, demand_arr = calculate_hourly_demand(total_customers, day_of_week, operational_hours=operational_hours)
         
         if st.session_state.roster_data:
-            hourly_coverage = calculate_hourly_coverage(st.session_state.roster_data, day_of_week)
-            recommendations = generate_recommendations(hourly_demand, hourly_coverage)
+            hourly_coverage, coverage_arr = calculate_hourly_coverage(
+                st.session_state.roster_min_arrays, day_of_week, operational_hours=operational_hours
+            )
+            recommendations, status = generate_recommendations(demand_arr, coverage_arr, operational_hours)
             
             # Create visualisation
             fig = go.Figure()
             
             # Customer demand bars
-            operational_hours = get_operational_hours(day_of_week)
             fig.add_trace(go.Bar(
                 x=operational_hours,
-                y=list(hourly_demand.values()),
+                y=demand_arr,
                 name="Customer Demand",
                 marker_color='lightblue',
                 opacity=0.7,
@@ -984,7 +1141,7 @@ def main():
             # Staff coverage line
             fig.add_trace(go.Scatter(
                 x=operational_hours,
-                y=list(hourly_coverage.values()),
+                y=coverage_arr,
                 name="Rostered Staff",
                 mode='lines+markers',
                 line=dict(color='green', width=3),
@@ -992,24 +1149,15 @@ def main():
                 yaxis='y2'
             ))
             
-            # Highlight problem hours
-            understaffed_hours = []
-            overstaffed_hours = []
-            
-            for hour in operational_hours:
-                demand = hourly_demand[hour]
-                coverage = hourly_coverage[hour]
-                required = np.ceil(demand / DEFAULT_STAFF_EFFICIENCY)
-                
-                if coverage < required:
-                    understaffed_hours.append(hour)
-                elif coverage > required * 1.2:
-                    overstaffed_hours.append(hour)
+            # Highlight problem hours, as classified by the recommendations
+            understaffed = status == 0
+            understaffed_hours = [operational_hours[i] for i in np.where(understaffed)[0]]
+            overstaffed_hours = [operational_hours[i] for i in np.where(status == 1)[0]]
             
             if understaffed_hours:
                 fig.add_trace(go.Scatter(
-                    x=understaffed_hours,
-                    y=[hourly_coverage[h] for h in understaffed_hours],
+                    x=hours_arr[understaffed],
+                    y=coverage_arr[understaffed],
                     name='Understaffed Hours',
                     mode='markers',
                     marker=dict(color='red', size=12, symbol='x'),
@@ -1031,16 +1179,12 @@ def main():
             # Recommendations table
             st.subheader("📋 Hourly Recommendations")
             
-            rec_data = []
-            for hour in operational_hours:
-                rec_data.append({
-                    'Hour': hour,
-                    'Customer Demand': hourly_demand[hour],
-                    'Rostered Staff': hourly_coverage[hour],
-                    'Recommendation': recommendations[hour]
-                })
-            
-            rec_df = pd.DataFrame(rec_data)
+            rec_df = pd.DataFrame({
+                'Hour': operational_hours,
+                'Customer Demand': demand_arr,
+                'Rostered Staff': coverage_arr,
+                'Recommendation': [recommendations[hour] for hour in operational_hours]
+            })
             st.dataframe(rec_df, use_container_width=True, hide_index=True)
             
             # Summary metrics
@@ -1063,11 +1207,10 @@ def main():
                 st.metric("Efficiency Ratio", f"{efficiency_ratio:.1f}%")
             
             # Download option
-            csv_buffer = io.StringIO()
-            rec_df.to_csv(csv_buffer, index=False)
+            csv_bytes = _csv_cache(rec_df)
             st.download_button(
                 label="📥 Download Analysis Report",
-                data=csv_buffer.getvalue(),
+                data=csv_bytes,
                 file_name=f"roster_analysis_{selected_date}_{day_of_week}.csv",
                 mime="text/csv"
             )
@@ -1077,10 +1220,9 @@ def main():
             
             # Show demand distribution only
             fig = go.Figure()
-            operational_hours = get_operational_hours(day_of_week)
             fig.add_trace(go.Bar(
                 x=operational_hours,
-                y=list(hourly_demand.values()),
+                y=demand_arr,
                 name="Customer Demand",
                 marker_color='lightblue'
             ))